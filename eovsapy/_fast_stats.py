@@ -0,0 +1,111 @@
+#
+# _FAST_STATS
+#
+# Numba-accelerated statistical kernels used by flare_spec and friends.
+# NumPy's nanmedian/nanmean reductions over the baseline axis are
+# single-threaded and partition the full array; for the modest number of
+# baselines (~90) involved here a parallel per-(freq,time) kernel is much
+# faster.  The input is transposed once so each kernel row is a contiguous
+# run of baseline values, giving the inner loops unit-stride access.  If
+# numba is not installed everything falls back transparently to the
+# equivalent (slower) NumPy calls.
+#
+# 2026-Aug-28  DG
+#   Initial version.
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _nanmedian_rows_jit(a, out):
+        # a is C-contiguous (nrows, nbl); one contiguous row per output cell
+        nrows, nbl = a.shape
+        for m in prange(nrows):
+            buf = np.empty(nbl, dtype=a.dtype)
+            n = 0
+            for k in range(nbl):
+                v = a[m, k]
+                if not np.isnan(v):
+                    buf[n] = v
+                    n += 1
+            if n == 0:
+                out[m] = np.nan
+            else:
+                b = np.sort(buf[:n])
+                if n % 2 == 1:
+                    out[m] = b[n // 2]
+                else:
+                    out[m] = 0.5 * (b[n // 2 - 1] + b[n // 2])
+
+    @njit(parallel=True, cache=True)
+    def _log10_clip_jit(a, lo, hi, out):
+        for i in prange(a.size):
+            v = a.flat[i] + lo
+            if v < lo:
+                v = lo
+            elif v > hi:
+                v = hi
+            out.flat[i] = np.log10(v)
+
+    @njit(parallel=True, cache=True)
+    def _nanmean_rows_jit(a, out):
+        nrows, nbl = a.shape
+        for m in prange(nrows):
+            s = 0.
+            n = 0
+            for k in range(nbl):
+                v = a[m, k]
+                if not np.isnan(v):
+                    s += v
+                    n += 1
+            if n == 0:
+                out[m] = np.nan
+            else:
+                out[m] = s / n
+
+def _as_rows(a):
+    # Transpose (nbl, nf, nt) -> contiguous (nf*nt, nbl) so the reduction
+    # axis is the fast one
+    nbl, nf, nt = a.shape
+    return np.ascontiguousarray(a.transpose(1, 2, 0)).reshape(nf * nt, nbl)
+
+def nanmedian_axis0(a):
+    ''' NaN-aware median over axis 0 of a 3-D float array (nbl, nf, nt).
+        Equivalent to np.nanmedian(a, 0) but parallelized over the
+        (freq, time) cells when numba is available.
+    '''
+    if njit is None:
+        return np.nanmedian(a, 0)
+    nbl, nf, nt = a.shape
+    out = np.empty(nf * nt, dtype=a.dtype)
+    _nanmedian_rows_jit(_as_rows(a), out)
+    return out.reshape(nf, nt)
+
+def log10_clip(a, lo, hi):
+    ''' Returns np.log10(np.clip(a + lo, lo, hi)) in a single fused pass over
+        the array when numba is available, avoiding the two full-size
+        temporaries of the separate add/clip/log10 calls.
+    '''
+    if njit is None:
+        return np.log10(np.clip(a + lo, lo, hi))
+    out = np.empty(a.shape, dtype=a.dtype)
+    _log10_clip_jit(a, lo, hi, out)
+    return out
+
+def nanmean_axis0(a):
+    ''' NaN-aware mean over axis 0 of a 3-D float array (nbl, nf, nt).
+        Equivalent to np.nanmean(a, 0) but parallelized over the
+        (freq, time) cells when numba is available.
+    '''
+    if njit is None:
+        return np.nanmean(a, 0)
+    nbl, nf, nt = a.shape
+    out = np.empty(nf * nt, dtype=a.dtype)
+    _nanmean_rows_jit(_as_rows(a), out)
+    return out.reshape(nf, nt)
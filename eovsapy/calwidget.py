@@ -1322,6 +1322,7 @@ def sql2refcalX(trange, *args, **kwargs):
     ''' Returns SQL refcal calibration records for the given timerange. trange can be either a timestamp or a timerange.'''
     from eovsapy import cal_header as ch
     from eovsapy.util import extract
+    from eovsapy.sqlutil import _amp_pha
     caltype = 8
     xml, bufs = ch.read_calX(caltype, t=trange, *args, **kwargs)
     if isinstance(bufs, np.ndarray):
@@ -1335,8 +1336,7 @@ def sql2refcalX(trange, *args, **kwargs):
                 timestamp = Time(extract(buf, xml['Timestamp']), format='lv')
                 tbg = Time(extract(buf, xml['T_beg']), format='lv')
                 ted = Time(extract(buf, xml['T_end']), format='lv')
-                pha = np.angle(ref)
-                amp = np.absolute(ref)
+                amp, pha = _amp_pha(ref)
                 refcals.append({'pha': pha, 'amp': amp, 'flag': flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp, 't_bg': tbg, 't_ed': ted})
             except:
                 print('failed to load record {} ---> {}'.format(i + 1, Time(extract(buf, xml['Timestamp']), format='lv').iso))
@@ -1349,8 +1349,7 @@ def sql2refcalX(trange, *args, **kwargs):
         timestamp = Time(extract(bufs, xml['Timestamp']), format='lv')
         tbg = Time(extract(bufs, xml['T_beg']), format='lv')
         ted = Time(extract(bufs, xml['T_end']), format='lv')
-        pha = np.angle(refcal)
-        amp = np.absolute(refcal)
+        amp, pha = _amp_pha(refcal)
         return {'pha': pha, 'amp': amp, 'flag': flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp, 't_bg': tbg, 't_ed': ted}
 
 
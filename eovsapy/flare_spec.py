@@ -23,10 +23,10 @@ Functions:
 sanitize_filename(name: str) -> str:
     Sanitizes the filename by replacing characters that might be invalid or problematic in file names across different operating systems.
 
-calIDB(trange: Union[List[str], str]) -> List[str]:
+calIDB(trange: Union[List[str], str], nproc: Optional[int] = None) -> List[str]:
     Calibrates and corrects saturation of relevant IDB files based on the provided time range or file list.
 
-inspect(files: List[str], vmin: float = 0.1, vmax: float = 10, ant_str: str = 'ant1-13', srcchk: bool = True) -> Tuple[dict, np.ndarray]:
+inspect(files: List[str], vmin: float = 0.1, vmax: float = 10, ant_str: str = 'ant1-13', srcchk: bool = True, memmap: bool = False) -> Tuple[dict, np.ndarray]:
     Reads and displays a log-scaled median spectrogram for quick check of the calibrated IDB files.
 
 combine_subtracted(out: dict, bgidx: List[int] = [100,110], vmin: float = 0.1, vmax: float = 10, ant_str: str = 'ant1-13') -> np.ndarray:
@@ -35,6 +35,9 @@ combine_subtracted(out: dict, bgidx: List[int] = [100,110], vmin: float = 0.1, v
 spec_data_to_fits(time: np.ndarray, fghz: np.ndarray, spec: np.ndarray, tpk: Optional[str] = None) -> str:
     Writes the EOVSA spectrum to a FITS file in the current folder.
 
+spec_data_to_hdf5(time: np.ndarray, fghz: np.ndarray, spec: np.ndarray, tpk: Optional[str] = None) -> str:
+    Writes the EOVSA spectrum to a compressed HDF5 file in the current folder (requires h5py).
+
 make_plot(out: dict, spec: np.ndarray, bgidx: List[int] = [100,110], bg2idx: Optional[List[int]] = None, vmin: float = 0.1, vmax: float = 10, lcfreqs: List[int] = [25, 235], name: Optional[str] = None, tpk: Optional[str] = None) -> Tuple[plt.Figure, plt.Axes, plt.Axes]:
     Makes the final, nicely formatted plot and saves the spectrogram as a binary data file for subsequent sharing/plotting.
 
@@ -54,9 +57,71 @@ from matplotlib.dates import DateFormatter
 from .util import Time, ant_str2list, common_val_idx
 from . import pipeline_cal as pc
 from . import read_idb as ri
+from ._fast_stats import nanmedian_axis0, nanmean_axis0, log10_clip
 import os
 import re
 
+def _get_times(out):
+    ''' Returns the Time array for the 'time' key of a read_idb output
+        dictionary, constructing it on first use and caching it in the
+        dictionary (Time construction is slow enough to matter when several
+        routines are called on the same data).  The cache is rebuilt if the
+        'time' array has been replaced.
+    '''
+    times = out.get('_times')
+    if times is None or out.get('_times_src') is not out['time']:
+        times = Time(out['time'], format='jd')
+        out['_times'] = times
+        out['_times_src'] = out['time']
+    return times
+
+def _baseline_index(ant_str):
+    ''' Returns the ordinal baseline indexes (into the 'x' key of a read_idb
+        output dictionary) for all antenna pairs implied by ant_str, using
+        NumPy fancy indexing instead of a per-pair Python loop.
+    '''
+    ants = np.asarray(ant_str2list(ant_str))
+    ii, jj = np.triu_indices(len(ants), k=1)
+    return ri.bl2ord[ants[ii], ants[jj]]
+
+def _memmap_x(out):
+    ''' Replaces out['x'] with a disk-backed memory map in a scratch .npy
+        file, copied one baseline at a time to bound peak memory.  Baseline
+        subsets indexed by later calls then stream from the page cache on
+        demand instead of pinning the whole visibility cube in memory, which
+        matters for long flares.  The scratch filename is recorded under
+        out['_x_scratch'] so the caller can remove it when done.
+    '''
+    import tempfile
+    if isinstance(out['x'], np.memmap):
+        return out['x']
+    fd, path = tempfile.mkstemp(prefix='eovsa_x_', suffix='.npy')
+    os.close(fd)
+    mm = np.lib.format.open_memmap(path, mode='w+', dtype=out['x'].dtype, shape=out['x'].shape)
+    for i in range(out['x'].shape[0]):
+        mm[i] = out['x'][i]
+    mm.flush()
+    out['x'] = mm
+    out['_x_scratch'] = path
+    return mm
+
+def _good_baselines(out, ant_str):
+    ''' Returns the baseline indexes for ant_str whose lengths fall in the
+        150-1000 nsec range, cached in the out dictionary so the typical
+        inspect()/combine_subtracted()/make_plot() sequence computes the
+        selection only once.
+    '''
+    if out.get('_idx_good_ant_str') == ant_str and '_idx_good' in out:
+        return out['_idx_good']
+    nt, = out['time'].shape
+    # Compare squared baseline lengths to squared thresholds -- no sqrt needed
+    blen2 = out['uvw'][:,nt//2,0]**2 + out['uvw'][:,nt//2,1]**2
+    idx = _baseline_index(ant_str)
+    good, = np.where((blen2[idx] > 150.**2) & (blen2[idx] < 1000.**2))
+    out['_idx_good'] = idx[good]
+    out['_idx_good_ant_str'] = ant_str
+    return out['_idx_good']
+
 def sanitize_filename(name):
     """
     Sanitize the filename by removing or replacing characters that might be invalid
@@ -66,17 +131,21 @@ def sanitize_filename(name):
     name = re.sub(r'\s+', '_', name).strip()  # Replace spaces and whitespace with underscore
     return name
 
-def calIDB(trange):
+def calIDB(trange, nproc=None):
     ''' Run udb_corr() on the relevant IDB files to calibrate them and correct saturation.
         The time range (a two-element Time array) is used to identify the files and the user
         is asked whether to continue after displaying the filenames.  If so, the calibration
         is a lengthy process that generates new files in the current directory with the same
         name as the originals, and the list of filenames is returned.
-        
+
         Input:
           trange    a two-element Time array, e.g. Time(['2021-05-29 23:00','2021-05-29 23:50'])
                       OR a string giving a file name OR a list of strings giving multiple filenames.
-          
+          nproc     The number of worker processes used to correct the files in parallel
+                      (each file is independent).  If None (default), half the machine's
+                      cores are used, to avoid thrashing the disk.  Set nproc=1 to force
+                      the old serial behavior.
+
         Output:
           files     a list of filenames of corrected files (from the current directory, so
                       the list has no path)
@@ -92,17 +161,28 @@ def calIDB(trange):
             else:
                 print('Could not interpret',trange,'as either a Time() object or a file list')
                 return []
-    print('The timerange corresponds to these files (will take about',len(files)*4,'minutes to process)')
+    if nproc is None:
+        nproc = max((os.cpu_count() or 1) // 2, 1)
+    nproc = min(nproc, len(files))
+    print('The timerange corresponds to these files (will take about',len(files)*4//max(nproc,1),'minutes to process)')
     for file in files: print(file)
-    ans = 'Y'
     ans = input('Do you want to continue? (say no if you want to adjust timerange) [y/n]?')
     outfiles = []
     if ans.upper() == 'Y':
-        for file in files:
-            outfiles.append(pc.udb_corr(file,calibrate=True,desat=True))
+        if nproc > 1:
+            # The files are independent, so correct them in parallel.  Use
+            # processes rather than threads -- udb_corr writes FITS, which is
+            # not thread-safe in astropy/cfitsio.
+            from concurrent.futures import ProcessPoolExecutor
+            from functools import partial
+            with ProcessPoolExecutor(max_workers=nproc) as ex:
+                outfiles = list(ex.map(partial(pc.udb_corr, calibrate=True, desat=True), files))
+        else:
+            for file in files:
+                outfiles.append(pc.udb_corr(file,calibrate=True,desat=True))
     return outfiles
     
-def inspect(files, vmin=0.1, vmax=10, ant_str='ant1-13', srcchk=True):
+def inspect(files, vmin=0.1, vmax=10, ant_str='ant1-13', srcchk=True, memmap=False):
     ''' Given the list of filenames output by calIDB(), reads and displays a log-scaled
         median (over baselines) spectrogram for quick check.  Input parameters allow the 
         displayed spectrogram to be scaled (vmin & vmax, which both should be positive 
@@ -125,7 +205,12 @@ def inspect(files, vmin=0.1, vmax=10, ant_str='ant1-13', srcchk=True):
                           source name, which is generally desired.  Files in the file list that
                           have different source names are skipped.  It can be set to False
                           to override this behavior.  Default is True.
-                          
+           memmap       If True, the visibility cube out['x'] is spilled to a
+                          disk-backed scratch file after reading, so this and later
+                          calls stream the baselines they need instead of holding
+                          the whole cube in memory.  Useful for long flares.
+                          Default is False.
+
         Outputs:
            out          Standard output dictionary of read_idb, containing all of the data
                           read from the files.  This includes the list of times and frequencies,
@@ -135,17 +220,11 @@ def inspect(files, vmin=0.1, vmax=10, ant_str='ant1-13', srcchk=True):
                           is not log-scaled or clipped.
     '''
     out = ri.read_idb(files, srcchk=srcchk)
-    times = Time(out['time'],format='jd')
-    nt, = out['time'].shape
-    blen = np.sqrt(out['uvw'][:,int(nt/2),0]**2 + out['uvw'][:,int(nt/2),1]**2)
-    ants = ant_str2list(ant_str)
-    idx = []
-    for k,i in enumerate(ants[:-1]):
-        for j in ants[k+1:]:
-            idx.append(ri.bl2ord[i,j])
-    idx = np.array(idx)
-    good, = np.where(np.logical_and(blen[idx] > 150.,blen[idx] < 1000.))
-    spec = np.nanmedian(np.abs(out['x'][idx[good],0]),0)
+    if memmap:
+        _memmap_x(out)
+    times = _get_times(out)
+    idx_good = _good_baselines(out, ant_str)
+    spec = nanmedian_axis0(np.abs(out['x'][idx_good,0]))
     nf, nt = spec.shape
     plt.figure()
     plt.imshow(np.log10(np.clip(spec,vmin,vmax)))
@@ -153,19 +232,14 @@ def inspect(files, vmin=0.1, vmax=10, ant_str='ant1-13', srcchk=True):
 
 def combine_subtracted(out, bgidx=[100,110], vmin=0.1, vmax=10, ant_str='ant1-13'):
     # Recreate spec from out, after subtracting
-    times = Time(out['time'],format='jd')
+    times = _get_times(out)
     nt, = out['time'].shape
     nf, = out['fghz'].shape
-    blen = np.sqrt(out['uvw'][:,int(nt/2),0]**2 + out['uvw'][:,int(nt/2),1]**2)
-    ants = ant_str2list(ant_str)
-    idx = []
-    for k,i in enumerate(ants[:-1]):
-        for j in ants[k+1:]:
-            idx.append(ri.bl2ord[i,j])
-    idx = np.array(idx)
-    good, = np.where(np.logical_and(blen[idx] > 150.,blen[idx] < 1000.))
-    bgd = np.nanmean(np.abs(out['x'][idx[good],0,:,bgidx[0]:bgidx[1]]),2).repeat(nt).reshape(len(idx[good]),nf,nt)
-    spec = np.nanmean(np.abs(out['x'][idx[good],0])-bgd,0)
+    idx_good = _good_baselines(out, ant_str)
+    xabs = np.abs(out['x'][idx_good,0])   # shape (nbl, nf, nt)
+    bgd = np.nanmean(xabs[:,:,bgidx[0]:bgidx[1]],2)   # shape (nbl, nf)
+    np.subtract(xabs, bgd[:,:,None], out=xabs)
+    spec = nanmean_axis0(xabs)
     return spec
 
 def spec_data_to_fits(time, fghz, spec, tpk=None):
@@ -186,9 +260,22 @@ def spec_data_to_fits(time, fghz, spec, tpk=None):
     observatory = 'Owens Valley Radio Observatory'
     observer = 'EOVSA Team'
 
-    hdu = fits.PrimaryHDU(spec)
+    # Store the spectrogram RICE-tile-compressed (behind a dummy primary HDU,
+    # as required for compressed images).  Tiles span the frequency axis so a
+    # frequency stripe can be read without inflating the whole image.
+    nf, nt = spec.shape
+    hdu = fits.PrimaryHDU()
+    try:
+        # tile_shape is in numpy axis order (astropy >= 5.3)
+        chdu = fits.CompImageHDU(spec.astype(np.float32), compression_type='RICE_1',
+                                 tile_shape=(nf, min(64, nt)))
+    except TypeError:
+        # Older astropy only has tile_size, which is in FITS (reversed) axis order
+        chdu = fits.CompImageHDU(spec.astype(np.float32), compression_type='RICE_1',
+                                 tile_size=(min(64, nt), nf))
+    chdu.name = 'SPEC'
     # Set up the extensions: FGHZ
-    col1 = fits.Column(name='FGHZ', format='E', array=fghz)
+    col1 = fits.Column(name='FGHZ', format='E', array=np.asarray(fghz, dtype='f4'))
     cols1 = fits.ColDefs([col1])
     tbhdu1 = fits.BinTableHDU.from_columns(cols1)
     tbhdu1.name = 'FGHZ'
@@ -198,6 +285,8 @@ def spec_data_to_fits(time, fghz, spec, tpk=None):
 
     # J is the format code for a 32 bit integer, who would have thought
     # http://astropy.readthedocs.org/en/latest/io/fits/usage/table.html
+    # TIME stays double precision -- float32 cannot represent a Julian date
+    # to better than ~hour accuracy.
     col3 = fits.Column(name='TIME', format='D', array=time)
 
     cols3 = fits.ColDefs([col3])#, col4
@@ -205,7 +294,7 @@ def spec_data_to_fits(time, fghz, spec, tpk=None):
     tbhdu3.name = 'TIME'
 
     # create an HDUList object to put in header information
-    hdulist = fits.HDUList([hdu, tbhdu1, tbhdu3])
+    hdulist = fits.HDUList([hdu, chdu, tbhdu1, tbhdu3])
 
     # primary header
     prihdr = hdulist[0].header
@@ -224,13 +313,60 @@ def spec_data_to_fits(time, fghz, spec, tpk=None):
     prihdr.set('YCEN', 0.0, 'Antenna pointing in arcsec from Sun center')
     prihdr.set('POLARIZA', 'I', 'Polarizations present')
     prihdr.set('RESOLUTI', 0.0, 'Resolution value')
-    # Write the file
-    hdulist.writeto(fitsfile, overwrite=True)
+    # Write the file.  Assemble it in memory first and write the whole buffer
+    # in one call -- writeto() direct to disk issues many small writes (one per
+    # header block), which is very slow on network filesystems.
+    import io
+    buf = io.BytesIO()
+    hdulist.writeto(buf)
+    with open(fitsfile, 'wb') as fh:
+        fh.write(buf.getbuffer())
 
     print(f'{fitsfile} saved')
     return fitsfile
 
- 
+def spec_data_to_hdf5(time, fghz, spec, tpk=None):
+    ''' Write EOVSA spectrum to an HDF5 file in the current folder, with the same
+        arrays and header information as spec_data_to_fits() but stored compressed
+        (gzip + byte shuffle) and chunked along the frequency axis to match the
+        typical "frequency stripe" read pattern.  Requires h5py.  tpk is the flare
+        peak time iso string.
+        example: h5file = spec_data_to_hdf5(time, fghz, spec, tpk='2024-02-10 22:47:00')
+    '''
+    from eovsapy.util import Time
+    import h5py
+
+    if tpk is None:
+        tpk = Time(time[0],format='jd').iso[:19]
+    # Convert peak time to flare_id
+    flare_id = tpk.replace('-','').replace(' ','').replace(':','')
+    h5file = f'eovsa.spec.flare_id_{flare_id}.h5'
+
+    nf, nt = spec.shape
+    with h5py.File(h5file, 'w') as f:
+        f.create_dataset('spec', data=spec.astype(np.float32), chunks=(nf, min(64, nt)),
+                         compression='gzip', shuffle=True)
+        f.create_dataset('fghz', data=np.asarray(fghz, dtype='f4'))
+        f.create_dataset('time', data=time)
+        f.attrs['FILENAME'] = h5file
+        f.attrs['ORIGIN'] = 'NJIT'
+        f.attrs['DATE'] = Time.now().isot
+        f.attrs['OBSERVER'] = 'EOVSA Team'
+        f.attrs['TELESCOP'] = 'EOVSA'
+        f.attrs['OBJ_ID'] = 'SUN'
+        f.attrs['TYPE'] = 1
+        f.attrs['DATE_OBS'] = Time(time[0], format='jd').isot
+        f.attrs['DATE_END'] = Time(time[-1], format='jd').isot
+        f.attrs['FREQMIN'] = min(fghz)
+        f.attrs['FREQMAX'] = max(fghz)
+        f.attrs['XCEN'] = 0.0
+        f.attrs['YCEN'] = 0.0
+        f.attrs['POLARIZA'] = 'I'
+        f.attrs['RESOLUTI'] = 0.0
+
+    print(f'{h5file} saved')
+    return h5file
+
 
 def make_plot(out, spec, bgidx=[100,110], bg2idx=None, vmin=0.1, vmax=10, lcfreqs=[25, 235], name=None, tpk=None):
     ''' Makes the final, nicely formatted plot and saves the spectrogram as a binary data
@@ -277,42 +413,41 @@ def make_plot(out, spec, bgidx=[100,110], bg2idx=None, vmin=0.1, vmax=10, lcfreq
     nf, nt = spec.shape
     ti = (out['time'] - out['time'][0])/(out['time'][-1] - out['time'][0]) # Relative time (0-1) of each datapoint
     if bgidx is None:
-        from copy import deepcopy
-        subspec = deepcopy(spec)
+        subspec = spec.copy()
     else:
         bgd1 = np.nanmean(spec[:,bgidx[0]:bgidx[1]],1)
         if bg2idx is None:
-            bgd = bgd1.repeat(nt).reshape(nf,nt)
+            # Broadcast the per-frequency background; no need to tile it to (nf,nt)
+            subspec = spec - bgd1[:,None]
         else:
             bgd2 = np.nanmean(spec[:,bg2idx[0]:bg2idx[1]],1)
-            bgd = np.zeros_like(spec)
             ti = (out['time'] - out['time'][bgidx[0]])/(out['time'][bg2idx[1]] - out['time'][bgidx[0]]) # Relative time (0-1) of each datapoint
-            for i in range(nt):
-                bgd[:,i] = (bgd2 - bgd1)*ti[i] + bgd1
-        subspec = spec-bgd
+            subspec = spec - (bgd1[:,None] + (bgd2 - bgd1)[:,None]*ti[None,:])
     # Next two lines force a gap in the plot for the notched frequencies (does nothing for pre-2019 data)
     bad, = np.where(abs(out['fghz'] - 1.742) < 0.001)
     if len(bad) > 0: subspec[bad] = np.nan
     #plt.imshow(np.log10(np.clip(subspec+vmin,vmin,vmax)))
 
     def fix_times(jd):
-        bad, = np.where(np.round((jd[1:] - jd[:-1])*86400) < 1)
-        for b in bad:
-            jd[b+1] = (jd[b] + jd[b+2])/2.
-        return Time(out['time'],format='jd')
+        bad = np.flatnonzero(np.round(np.diff(jd)*86400) < 1)
+        if len(bad) > 0:
+            jd[bad+1] = 0.5*(jd[bad] + jd[bad+2])
+            # Times were adjusted in place, so any cached Time is stale
+            out.pop('_times_src', None)
+        return _get_times(out)
 
     times = fix_times(out['time'])
     # Make sure time gaps look like gaps
-    gaps = np.where(np.round((out['time'][1:] - out['time'][:-1])*86400) > 1)
-    for gap in gaps:
-        subspec[:,gap] = np.nan
+    gaps = np.flatnonzero(np.round(np.diff(out['time'])*86400) > 1)
+    subspec[:,gaps] = np.nan
     
     f = plt.figure(figsize=[14,8])
     ax0 = plt.subplot(211)
     ax1 = plt.subplot(212)
-    im2 = ax0.pcolormesh(times.plot_date,out['fghz'],np.log10(np.clip(subspec+vmin,vmin,vmax)))
-    for frq in lcfreqs:
-        lc = np.nanmean(subspec[frq-5:frq+5],0)
+    im2 = ax0.pcolormesh(times.plot_date,out['fghz'],log10_clip(subspec,vmin,vmax))
+    # Average all lightcurve bands in one call, then loop only for plotting
+    lcs = np.nanmean(np.stack([subspec[frq-5:frq+5] for frq in lcfreqs]),1)
+    for frq,lc in zip(lcfreqs,lcs):
         ax1.step(times.plot_date,lc,label=str(out['fghz'][frq])[:6]+' GHz')
     ax1.set_ylim(-0.5,vmax)
     ax1.xaxis_date()
@@ -1,30 +1,79 @@
 from .util import Time
 import numpy as np
 from . import cal_header as ch
-from .util import extract
+from .util import extract, extract_many
 
-def sql2refcalX(trange, *args, **kwargs):
-    ''' Returns SQL refcal calibration records for the given timerange. trange can be either a timestamp or a timerange.'''
+def _amp_pha(z):
+    ''' Returns (amp, pha) of a complex array in a single pass, writing both
+        float32 outputs directly instead of allocating the float64 temporaries
+        that separate np.absolute/np.angle calls would.
+    '''
+    amp = np.empty(z.shape, np.float32)
+    pha = np.empty(z.shape, np.float32)
+    np.abs(z, out=amp)
+    np.arctan2(z.imag, z.real, out=pha)
+    return amp, pha
+
+def _stack_records(records):
+    ''' Converts a list of per-record dicts into a single dict of arrays
+        stacked along a new leading record axis (structure-of-arrays layout).
+        Time values become one Time array of length N and nested dicts are
+        converted recursively.
+    '''
+    out = {}
+    for key, val in records[0].items():
+        vals = [rec[key] for rec in records]
+        if isinstance(val, dict):
+            out[key] = _stack_records(vals)
+        elif isinstance(val, Time):
+            out[key] = Time(vals)
+        else:
+            out[key] = np.stack(vals)
+    return out
+
+def sql2refcalX(trange, *args, as_records=True, **kwargs):
+    ''' Returns SQL refcal calibration records for the given timerange. trange can be either a timestamp or a timerange.
+        If as_records is False and multiple records are found, a single dict of arrays stacked over records
+        (structure-of-arrays) is returned instead of a list of per-record dicts.'''
 
     caltype = 8
     xml, bufs = ch.read_calX(caltype, t=trange, *args, **kwargs)
     if isinstance(bufs, np.ndarray):
-        refcals = []
-        for i, buf in enumerate(bufs):
-            try:
-                ref = extract(buf, xml['Refcal_Real']) + extract(buf, xml['Refcal_Imag']) * 1j
-                flag = extract(buf, xml['Refcal_Flag'])
-                fghz = extract(buf, xml['Fghz'])
-                sigma = extract(buf, xml['Refcal_Sigma'])
-                timestamp = Time(extract(buf, xml['Timestamp']), format='lv')
-                tbg = Time(extract(buf, xml['T_beg']), format='lv')
-                ted = Time(extract(buf, xml['T_end']), format='lv')
-                pha = np.angle(ref)
-                amp = np.absolute(ref)
-                refcals.append({'pha': pha, 'amp': amp, 'flag': flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp, 't_bg': tbg, 't_ed': ted})
-            except:
-                print('failed to load record {} ---> {}'.format(i + 1, Time(extract(buf, xml['Timestamp']), format='lv').iso))
-        return refcals
+        try:
+            # Parse each field across all records in one batched call (SoA layout),
+            # then build the per-record dicts as views into the stacked arrays.
+            ref = extract_many(bufs, xml['Refcal_Real']) + extract_many(bufs, xml['Refcal_Imag']) * 1j
+            flag = extract_many(bufs, xml['Refcal_Flag'])
+            fghz = extract_many(bufs, xml['Fghz'])
+            sigma = extract_many(bufs, xml['Refcal_Sigma'])
+            timestamp = Time(extract_many(bufs, xml['Timestamp']), format='lv')
+            tbg = Time(extract_many(bufs, xml['T_beg']), format='lv')
+            ted = Time(extract_many(bufs, xml['T_end']), format='lv')
+            amp, pha = _amp_pha(ref)
+            if not as_records:
+                return {'pha': pha, 'amp': amp, 'flag': flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp, 't_bg': tbg, 't_ed': ted}
+            return [{'pha': pha[i], 'amp': amp[i], 'flag': flag[i], 'fghz': fghz[i], 'sigma': sigma[i], 'timestamp': timestamp[i], 't_bg': tbg[i], 't_ed': ted[i]}
+                    for i in range(len(bufs))]
+        except:
+            # Batched parse failed (e.g. a malformed record); fall back to
+            # record-at-a-time parsing so the good records are still returned.
+            refcals = []
+            for i, buf in enumerate(bufs):
+                try:
+                    ref = extract(buf, xml['Refcal_Real']) + extract(buf, xml['Refcal_Imag']) * 1j
+                    flag = extract(buf, xml['Refcal_Flag'])
+                    fghz = extract(buf, xml['Fghz'])
+                    sigma = extract(buf, xml['Refcal_Sigma'])
+                    timestamp = Time(extract(buf, xml['Timestamp']), format='lv')
+                    tbg = Time(extract(buf, xml['T_beg']), format='lv')
+                    ted = Time(extract(buf, xml['T_end']), format='lv')
+                    amp, pha = _amp_pha(ref)
+                    refcals.append({'pha': pha, 'amp': amp, 'flag': flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp, 't_bg': tbg, 't_ed': ted})
+                except:
+                    print('failed to load record {} ---> {}'.format(i + 1, Time(extract(buf, xml['Timestamp']), format='lv').iso))
+            if not as_records and refcals:
+                return _stack_records(refcals)
+            return refcals
     elif isinstance(bufs, bytes):
         refcal = extract(bufs, xml['Refcal_Real']) + extract(bufs, xml['Refcal_Imag']) * 1j
         flag = extract(bufs, xml['Refcal_Flag'])
@@ -33,39 +82,67 @@ def sql2refcalX(trange, *args, **kwargs):
         timestamp = Time(extract(bufs, xml['Timestamp']), format='lv')
         tbg = Time(extract(bufs, xml['T_beg']), format='lv')
         ted = Time(extract(bufs, xml['T_end']), format='lv')
-        pha = np.angle(refcal)
-        amp = np.absolute(refcal)
+        amp, pha = _amp_pha(refcal)
         return {'pha': pha, 'amp': amp, 'flag': flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp, 't_bg': tbg, 't_ed': ted}
 
 
-def sql2phacalX(trange, *args, **kwargs):
+def sql2phacalX(trange, *args, as_records=True, **kwargs):
     '''Supply a timestamp in Time format, return the closest phacal data.
-        If a time range is provided, return records within the time range.'''
+        If a time range is provided, return records within the time range.
+        If as_records is False and multiple records are found, a single dict of arrays stacked over records
+        (structure-of-arrays) is returned instead of a list of per-record dicts.'''
     from . import cal_header as ch
     from .util import extract
     xml, bufs = ch.read_calX(9, t=trange, *args, **kwargs)
     if isinstance(bufs, np.ndarray):
-        phacals = []
-        for i, buf in enumerate(bufs):
-            try:
-                phacal_flag = extract(buf, xml['Phacal_Flag'])
-                fghz = extract(buf, xml['Fghz'])
-                sigma = extract(buf, xml['Phacal_Sigma'])
-                timestamp = Time(extract(buf, xml['Timestamp']), format='lv')
-                tbg = Time(extract(buf, xml['T_beg']), format='lv')
-                ted = Time(extract(buf, xml['T_end']), format='lv')
-                pha = extract(buf, xml['Phacal_Pha'])
-                amp = extract(buf, xml['Phacal_Amp'])
-                tmp = extract(buf, xml['MBD'])
-                poff, pslope = tmp[:, :, 0], tmp[:, :, 1]
-                flag = extract(buf, xml['Flag'])[:, :, 0]
-                t_ref = Time(extract(buf, xml['T_refcal']), format='lv')
-                phacals.append({'pslope': pslope, 't_pha': timestamp, 'flag': flag, 'poff': poff, 't_ref': t_ref,
-                                'phacal': {'pha': pha, 'amp': amp, 'flag': phacal_flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp,
-                                           't_bg': tbg, 't_ed': ted}})
-            except:
-                print('failed to load record {} ---> {}'.format(i + 1, Time(extract(buf, xml['Timestamp']), format='lv').iso))
-        return phacals
+        try:
+            # Batched field extraction (SoA layout); see sql2refcalX.
+            phacal_flag = extract_many(bufs, xml['Phacal_Flag'])
+            fghz = extract_many(bufs, xml['Fghz'])
+            sigma = extract_many(bufs, xml['Phacal_Sigma'])
+            timestamp = Time(extract_many(bufs, xml['Timestamp']), format='lv')
+            tbg = Time(extract_many(bufs, xml['T_beg']), format='lv')
+            ted = Time(extract_many(bufs, xml['T_end']), format='lv')
+            pha = extract_many(bufs, xml['Phacal_Pha'])
+            amp = extract_many(bufs, xml['Phacal_Amp'])
+            tmp = extract_many(bufs, xml['MBD'])
+            poff, pslope = tmp[..., 0], tmp[..., 1]
+            flag = extract_many(bufs, xml['Flag'])[..., 0]
+            t_ref = Time(extract_many(bufs, xml['T_refcal']), format='lv')
+            if not as_records:
+                return {'pslope': pslope, 't_pha': timestamp, 'flag': flag, 'poff': poff, 't_ref': t_ref,
+                        'phacal': {'pha': pha, 'amp': amp, 'flag': phacal_flag, 'fghz': fghz, 'sigma': sigma,
+                                   'timestamp': timestamp, 't_bg': tbg, 't_ed': ted}}
+            return [{'pslope': pslope[i], 't_pha': timestamp[i], 'flag': flag[i], 'poff': poff[i], 't_ref': t_ref[i],
+                     'phacal': {'pha': pha[i], 'amp': amp[i], 'flag': phacal_flag[i], 'fghz': fghz[i], 'sigma': sigma[i],
+                                'timestamp': timestamp[i], 't_bg': tbg[i], 't_ed': ted[i]}}
+                    for i in range(len(bufs))]
+        except:
+            # Fall back to record-at-a-time parsing so the good records are
+            # still returned.
+            phacals = []
+            for i, buf in enumerate(bufs):
+                try:
+                    phacal_flag = extract(buf, xml['Phacal_Flag'])
+                    fghz = extract(buf, xml['Fghz'])
+                    sigma = extract(buf, xml['Phacal_Sigma'])
+                    timestamp = Time(extract(buf, xml['Timestamp']), format='lv')
+                    tbg = Time(extract(buf, xml['T_beg']), format='lv')
+                    ted = Time(extract(buf, xml['T_end']), format='lv')
+                    pha = extract(buf, xml['Phacal_Pha'])
+                    amp = extract(buf, xml['Phacal_Amp'])
+                    tmp = extract(buf, xml['MBD'])
+                    poff, pslope = tmp[:, :, 0], tmp[:, :, 1]
+                    flag = extract(buf, xml['Flag'])[:, :, 0]
+                    t_ref = Time(extract(buf, xml['T_refcal']), format='lv')
+                    phacals.append({'pslope': pslope, 't_pha': timestamp, 'flag': flag, 'poff': poff, 't_ref': t_ref,
+                                    'phacal': {'pha': pha, 'amp': amp, 'flag': phacal_flag, 'fghz': fghz, 'sigma': sigma, 'timestamp': timestamp,
+                                               't_bg': tbg, 't_ed': ted}})
+                except:
+                    print('failed to load record {} ---> {}'.format(i + 1, Time(extract(buf, xml['Timestamp']), format='lv').iso))
+            if not as_records and phacals:
+                return _stack_records(phacals)
+            return phacals
     elif isinstance(bufs, bytes):
         phacal_flag = extract(bufs, xml['Phacal_Flag'])
         fghz = extract(bufs, xml['Fghz'])
@@ -1067,6 +1067,26 @@ def extract(data,k):
        val = struct.unpack_from(k[0],data,k[1])[0]
     return val
 
+def extract_many(bufs,k):
+    '''Batched version of extract().  Parses the same stateframe field from a
+       sequence of byte buffers into a single stacked ndarray of shape
+       (len(bufs),) + field shape, avoiding a separate array allocation per
+       record.
+    '''
+    import struct
+    if len(k) == 3:
+       k[2].reverse()
+       shape = tuple(k[2])
+       k[2].reverse()
+       val = np.empty((len(bufs),)+shape)
+       for i,buf in enumerate(bufs):
+          val[i] = np.array(struct.unpack_from(k[0],buf,k[1])).reshape(shape)
+    else:
+       val = np.empty(len(bufs))
+       for i,buf in enumerate(bufs):
+          val[i] = struct.unpack_from(k[0],buf,k[1])[0]
+    return val
+
 def lobe(phi, mid=True):
     # Ensures that value phi lies between -pi and pi (if mid = True)
     # or 0 and 2*pi (if mid = False)
@@ -1130,17 +1150,13 @@ def bl_list(nant=16):
         number of the baseline in the 'x' key.  Note bl2ord(i,j) = bl2ord(j,i),
         and bl2ord(i,i) = nant*(nant-1)//2 + i.
     '''
-    from numpy import ones
-    bl2ord = ones((nant, nant), dtype='int') * (-1)
+    bl2ord = np.full((nant, nant), -1, dtype=np.int32)
     nbl = nant * (nant - 1) // 2
-    k = 0
-    for i in range(nant - 1):
-        for j in range(i + 1, nant):
-            bl2ord[i, j] = k
-            bl2ord[j, i] = k
-            k += 1
-    for i in range(nant):
-        bl2ord[i, i] = nbl + i
+    i, j = np.triu_indices(nant, k=1)
+    k = np.arange(nbl, dtype=np.int32)
+    bl2ord[i, j] = k
+    bl2ord[j, i] = k
+    bl2ord[np.diag_indices(nant)] = nbl + np.arange(nant, dtype=np.int32)
     return bl2ord
 
 